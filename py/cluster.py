@@ -0,0 +1,220 @@
+"""Relays sensor data from the ingesting node to peer nodes.
+
+The node receiving sensor UDP forwards one frame per tick with all sensor
+packets received during that tick (`Relay`). Peer nodes (`PeerProtocol`) feed
+these records into their own tick loop, so every node renders its local
+fixtures from the shared stream. Frames can be sent via unicast or multicast
+UDP. On hosts with several interfaces, the interface for multicast can be
+selected by its local address ("239.255.0.4@192.168.1.10").
+
+Frame layout:
+
+  >4s  MAGIC
+  >L   session (random per relay process, resets peer state on restart)
+  >L   sequence number
+  >L   sender time (ms)
+  B    number of records
+  per record:
+    >4s  sensor IPv4 address
+    >H   sensor port
+    >H   age of record at sender time (ms)
+    >9e  sensor values (float16)
+
+Peers estimate the clock offset as the minimum of (local time - sender time)
+over the last frames. This includes the minimal network delay, which is what
+we want for converting sender timestamps to local time.
+"""
+
+import collections
+import ipaddress
+import logging
+import random
+import socket
+import struct
+import time
+
+
+MAGIC = b'PNC1'
+HEADER = struct.Struct('>4sLLLB')
+RECORD = struct.Struct('>4sHH9e')
+MAX_RECORDS = 255
+FLOAT16_MAX = 65504.0
+
+
+def parse_addr(s, default_port):
+  """Parses "host:port", "host" or "port" into `(host, port, interface)`.
+
+  Any of these can be followed by "@interface", the local IPv4 address of the
+  interface used for multicast (default: None, chosen by routing table).
+  """
+  s, _, interface = s.partition('@')
+  if interface:
+    ipaddress.IPv4Address(interface)  # raises ValueError
+  host, _, port = s.rpartition(':')
+  if not host:
+    if s.isdigit():
+      return '', int(s), interface or None
+    return s, default_port, interface or None
+  return host, int(port), interface or None
+
+
+def is_multicast(host):
+  try:
+    return ipaddress.IPv4Address(host).is_multicast
+  except ValueError:
+    return False
+
+
+def encode_frame(session, seq, t, records):
+  """Encodes `records` as `(t, 'ip:port', values)` received until `t` (ms)."""
+  out = [HEADER.pack(MAGIC, session, seq, t, len(records))]
+  for rt, addr, values in records:
+    ip, port = addr.rsplit(':', 1)
+    values = (max(-FLOAT16_MAX, min(FLOAT16_MAX, v)) for v in values)
+    age = max(0, min(0xffff, t - rt))
+    out.append(RECORD.pack(socket.inet_aton(ip), int(port), age, *values))
+  return b''.join(out)
+
+
+def decode_frame(data):
+  """Returns `(session, seq, t, [(age, 'ip:port', values)])`."""
+  magic, session, seq, t, n = HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise ValueError(f'Invalid magic: {magic}')
+  if len(data) != HEADER.size + n * RECORD.size:
+    raise ValueError(f'Invalid frame size for {n} records: {len(data)}')
+  records = []
+  for i in range(n):
+    ip, port, age, *values = RECORD.unpack_from(data, HEADER.size + i * RECORD.size)
+    records.append((age, f'{socket.inet_ntoa(ip)}:{port}', values))
+  return session, seq, t, records
+
+
+class Relay:
+  """Sends frames to unicast and/or multicast `targets`.
+
+  `targets` are `(host, port, interface)` as returned by `parse_addr()`; every
+  interface gets its own socket.
+  """
+
+  def __init__(self, targets, ttl=1):
+    self.targets = targets
+    self.session = random.getrandbits(32)
+    self.seq = 0
+    self.logger = logging.getLogger('Relay')
+    self.socks = {}
+    for host, _, interface in targets:
+      if interface not in self.socks:
+        self.socks[interface] = self._create_socket(interface, ttl)
+    self.logger.info('Relaying to %s', ', '.join(
+        f'{host}:{port}' + (f'@{interface}' if interface else '') for host, port, interface in targets))
+
+  @staticmethod
+  def _create_socket(interface, ttl):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    if interface:
+      sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    return sock
+
+  def send(self, t, records):
+    for i in range(0, max(1, len(records)), MAX_RECORDS):
+      frame = encode_frame(self.session, self.seq, t, records[i:i + MAX_RECORDS])
+      self.seq = (self.seq + 1) & 0xffffffff
+      for host, port, interface in self.targets:
+        try:
+          self.socks[interface].sendto(frame, (host, port))
+        except OSError as e:
+          self.logger.error(f'Error relaying to {host}:{port}: {e}')
+
+  def close(self):
+    for sock in self.socks.values():
+      sock.close()
+
+
+def create_peer_socket(host, port, interface=None):
+  """Returns socket bound to `port`, joining multicast group `host` if any.
+
+  The group is joined on `interface` (local IPv4 address), or on the interface
+  chosen by the routing table if None.
+  """
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  if is_multicast(host):
+    # several peers on the same host; for unicast this would split frames
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    mreq = struct.pack('4s4s', socket.inet_aton(host), socket.inet_aton(interface or '0.0.0.0'))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+  else:
+    sock.bind((host or '0.0.0.0', port))
+  sock.setblocking(False)
+  return sock
+
+
+class PeerProtocol:
+  """Receives frames from `Relay`, calls `on_record(t, addr, values)`.
+
+  `clock()` returns local time in ms, `t` is converted to local time.
+  """
+
+  def __init__(self, on_record, clock, window=256, log_interval=10.0):
+    self.on_record = on_record
+    self.clock = clock
+    self.log_interval = log_interval
+    self.offsets = collections.deque(maxlen=window)
+    self.session = None
+    self.seq = None
+    self.stats = dict(received=0, lost=0, dropped=0, offset=None)
+    self._last_log = 0
+    self._last_stats = None
+    self.transport = None
+    self.logger = logging.getLogger('PeerProtocol')
+
+  def connection_made(self, transport):
+    self.transport = transport
+    self.logger.info('Peer started')
+
+  def connection_lost(self, exc):
+    self.transport = None
+    if exc:
+      self.logger.error(f'Peer connection lost with error: {exc}')
+
+  def error_received(self, exc):
+    self.logger.warning(f'Peer error: {exc}')
+
+  def datagram_received(self, data, addr):
+    local_t = self.clock()
+    try:
+      session, seq, t, records = decode_frame(data)
+    except (ValueError, struct.error) as e:
+      self.logger.warning(f'Received invalid frame from {addr}: {e}')
+      return
+
+    if session != self.session:
+      self.logger.info('New relay session %08x from %s:%d', session, *addr)
+      self.session = session
+      self.seq = None
+      self.offsets.clear()
+    if self.seq is not None:
+      diff = (seq - self.seq) & 0xffffffff
+      if diff == 0 or diff >= 0x80000000:
+        self.stats['dropped'] += 1  # duplicate or reordered
+        return
+      self.stats['lost'] += diff - 1
+    self.seq = seq
+    self.stats['received'] += 1
+
+    self.offsets.append(local_t - t)
+    offset = self.stats['offset'] = min(self.offsets)
+    for age, sensor_addr, values in records:
+      self.on_record(max(0, t + offset - age), sensor_addr, values)
+
+    now = time.monotonic()
+    if now - self._last_log > self.log_interval and self.stats != self._last_stats:
+      self._last_log = now
+      self._last_stats = dict(self.stats)
+      self.logger.info('received=%(received)d lost=%(lost)d dropped=%(dropped)d offset=%(offset)dms', self.stats)
@@ -0,0 +1,203 @@
+"""Announces server presence to sensors via UDP.
+
+Sensors listen on UDP_BROADCAST_PORT for `MESSAGE` and use the sender address
+as server address. Announcements are sent on all matching interfaces (see
+`netutils.get_broadcast_addrs()`):
+
+- In a burst at startup, when a sensor disconnects and when the interfaces
+  change (e.g. after a Wi-Fi dropout).
+- Every `interval` seconds otherwise.
+- Every `idle_interval` seconds when all `expected` sensors are connected
+  (only if `expected` is given).
+
+Additionally, `REQUEST` sent to the discovery port is immediately answered
+with a unicast `MESSAGE`.
+
+Errors are logged and never raised from `run()`, since the server should keep
+sending OSC to connected sensors even if it cannot announce itself.
+"""
+
+import asyncio
+import logging
+import socket
+import time
+
+
+MESSAGE = b'PANTONE1'
+REQUEST = b'PANTONE?'
+
+# delays between announcements in a burst
+BURST = (0.25, 0.25, 0.5, 1.0, 2.0)
+
+
+class DiscoveryRequestProtocol:
+  def __init__(self, service):
+    self.service = service
+
+  def connection_made(self, transport):
+    pass
+
+  def connection_lost(self, exc):
+    pass
+
+  def error_received(self, exc):
+    self.service.logger.warning(f'Discovery request error: {exc}')
+
+  def datagram_received(self, data, addr):
+    if data.rstrip(b'\0\n') == REQUEST:
+      self.service.reply(addr)
+
+
+class DiscoveryService:
+  def __init__(
+      self, broadcast_port, request_port, *,
+      expected=0, interval=5.0, idle_interval=30.0, timeout=2.0, forget=60.0,
+      refresh=10.0, on_announce=None,
+  ):
+    """Creates service, call `run()` to start announcing.
+
+    Args:
+      broadcast_port: Port sensors listen on for announcements.
+      request_port: Port to listen on for discovery requests.
+      expected: Number of expected sensors. If 0, announcements are always
+        sent every `interval` seconds, since new sensors could join anytime.
+      interval: Seconds between announcements.
+      idle_interval: Seconds between announcements if all `expected` sensors
+        are connected.
+      timeout: Seconds without packets after which a sensor is disconnected.
+      forget: Seconds without packets after which a sensor is forgotten.
+      refresh: Seconds between interface scans.
+      on_announce: Called after every successful announcement.
+    """
+    self.broadcast_port = broadcast_port
+    self.request_port = request_port
+    self.expected = expected
+    self.interval = interval
+    self.idle_interval = idle_interval
+    self.timeout = timeout
+    self.forget = forget
+    self.refresh = refresh
+    self.on_announce = on_announce
+    self.logger = logging.getLogger('DiscoveryService')
+
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    self.sock.setblocking(False)
+
+    self.interfaces = []
+    self.last_seen = {}
+    self.connected = set()
+    self._burst = []
+    self._next_send = 0
+    self._next_refresh = 0
+
+  def seen(self, addr, now=None):
+    """Marks sensor `addr` ("ip:port") as connected.
+
+    Sensors are identified by IP, since they use a new port when reconnecting.
+    """
+    ip = addr.rsplit(':', 1)[0]
+    self.last_seen[ip] = time.monotonic() if now is None else now
+
+  def burst(self):
+    self._burst = list(BURST)
+    self._next_send = 0
+
+  def reply(self, addr):
+    self.logger.info('Discovery request from %s:%d', *addr)
+    try:
+      self.sock.sendto(MESSAGE, addr)
+      if addr[1] != self.broadcast_port:
+        self.sock.sendto(MESSAGE, (addr[0], self.broadcast_port))
+    except OSError as e:
+      self.logger.error(f'Could not reply to discovery request from {addr}: {e}')
+
+  def all_connected(self):
+    return self.expected > 0 and len(self.connected) >= self.expected
+
+  async def _refresh_interfaces(self):
+    loop = asyncio.get_running_loop()
+    self._next_refresh = time.monotonic() + self.refresh
+    try:
+      import netutils
+
+      interfaces = await loop.run_in_executor(None, netutils.get_broadcast_addrs)
+    except Exception as e:
+      self.logger.error(f'Could not list interfaces: {e}')
+      return
+    if interfaces != self.interfaces:
+      if interfaces:
+        self.logger.info('Announcing on %s', ', '.join(f'{iface}={addr}' for iface, addr in interfaces))
+      else:
+        self.logger.error('No valid broadcast address found')
+      self.interfaces = interfaces
+      self.burst()
+
+  def _update_connected(self, now):
+    for ip in [ip for ip, t in self.last_seen.items() if now - t >= self.forget]:
+      del self.last_seen[ip]
+    connected = {ip for ip, t in self.last_seen.items() if now - t < self.timeout}
+    lost = self.connected - connected
+    if lost:
+      self.logger.info('Lost %s, announcing', ', '.join(sorted(lost)))
+      self.burst()
+    self.connected = connected
+
+  def _announce(self):
+    sent = False
+    for iface, addr in self.interfaces:
+      try:
+        self.sock.sendto(MESSAGE, (addr, self.broadcast_port))
+        sent = True
+      except OSError as e:
+        self.logger.warning(f'Could not announce on {iface}={addr}: {e}')
+        self._next_refresh = 0
+    self.logger.debug(f'Broadcast ping {MESSAGE} sent')
+    if sent and self.on_announce:
+      self.on_announce()
+
+  def _deadline(self):
+    """Returns time of the next send, refresh or possible disconnect."""
+    return min(
+        self._next_send,
+        self._next_refresh,
+        *(self.last_seen[ip] + self.timeout for ip in self.connected if ip in self.last_seen),
+    )
+
+  async def _step(self):
+    now = time.monotonic()
+    if now >= self._next_refresh:
+      await self._refresh_interfaces()
+    self._update_connected(now)
+    if now >= self._next_send:
+      self._announce()
+      if self._burst:
+        delay = self._burst.pop(0)
+      else:
+        delay = self.idle_interval if self.all_connected() else self.interval
+      self._next_send = now + delay
+    await asyncio.sleep(max(0, self._deadline() - time.monotonic()))
+
+  async def run(self, running):
+    """Announces until `running` is cleared, logging (not raising) errors."""
+    loop = asyncio.get_running_loop()
+    transport = None
+    try:
+      transport, _ = await loop.create_datagram_endpoint(
+          lambda: DiscoveryRequestProtocol(self),
+          local_addr=('0.0.0.0', self.request_port),
+      )
+    except Exception as e:
+      self.logger.error(f'Not answering discovery requests on port {self.request_port}: {e}')
+    try:
+      while running.is_set():
+        try:
+          await self._step()
+        except Exception:
+          self.logger.exception('Discovery failed, retrying in %.0fs', self.interval)
+          await asyncio.sleep(self.interval)
+      self.logger.info('stopping')
+    finally:
+      if transport:
+        transport.close()
+      self.sock.close()
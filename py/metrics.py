@@ -0,0 +1,139 @@
+"""In-process time-series store with fixed memory.
+
+Every series is downsampled into `RingBuffer`s at several resolutions (1 s,
+10 s, 1 min by default). Each row holds `(t, value, max)` where `value` is
+the mean of the samples for gauges and the rate per second for counters.
+Intervals without samples are reported as 0, so e.g. a silent sensor shows a
+packet rate of 0 rather than its last rate.
+Memory is bounded by preallocated buffers and `max_series`. Series named
+"source/metric" (e.g. per sensor) are evicted per source, least recently
+updated first, when the limit is reached; other (global) series are never
+evicted.
+"""
+
+import array
+import datetime
+
+
+# (seconds per row, number of rows): 5 minutes, 1 hour, 1 day
+RESOLUTIONS = ((1, 300), (10, 360), (60, 1440))
+
+
+class RingBuffer:
+  """Fixed size buffer of `(t, value, max)` rows."""
+
+  def __init__(self, size):
+    self.size = size
+    self.data = array.array('d', bytes(8 * 3 * size))
+    self.n = 0
+
+  def append(self, t, value, max_value):
+    i = 3 * (self.n % self.size)
+    self.data[i:i + 3] = array.array('d', (t, value, max_value))
+    self.n += 1
+
+  def rows(self, since=0):
+    for k in range(max(0, self.n - self.size), self.n):
+      i = 3 * (k % self.size)
+      if self.data[i] >= since:
+        yield tuple(self.data[i:i + 3])
+
+
+class Series:
+  def __init__(self, kind, resolutions):
+    self.kind = kind
+    self.buffers = {res: RingBuffer(size) for res, size in resolutions}
+    # res -> [bucket start, count, sum, max]
+    self.buckets = {res: None for res, _ in resolutions}
+    self.updated = 0
+
+  def _row(self, res, bucket):
+    start, count, total, max_value = bucket
+    if not count:
+      return start, 0.0, 0.0
+    if self.kind == 'counter':
+      return start, total / res, total / res
+    return start, total / count, max_value
+
+  def advance(self, now):
+    """Closes elapsed buckets, adding zero rows for intervals without samples."""
+    for res, bucket in self.buckets.items():
+      start = now - now % res
+      if bucket is None:
+        self.buckets[res] = [start, 0, 0.0, 0.0]
+        continue
+      if start <= bucket[0]:
+        continue
+      buffer = self.buffers[res]
+      buffer.append(*self._row(res, bucket))
+      missing = min(round((start - bucket[0]) / res) - 1, buffer.size)
+      for i in range(missing, 0, -1):
+        buffer.append(start - i * res, 0.0, 0.0)
+      self.buckets[res] = [start, 0, 0.0, 0.0]
+
+  def add(self, value, now):
+    self.updated = now
+    self.advance(now)
+    for bucket in self.buckets.values():
+      bucket[3] = max(bucket[3], value) if bucket[1] else value
+      bucket[1] += 1
+      bucket[2] += value
+
+  def rows(self, res, since):
+    return list(self.buffers[res].rows(since))
+
+
+class MetricsStore:
+
+  def __init__(self, resolutions=RESOLUTIONS, max_series=64):
+    self.resolutions = resolutions
+    self.max_series = max_series
+    self.series = {}
+
+  def _evict(self):
+    updated = {}
+    for name, series in self.series.items():
+      source, sep, _ = name.rpartition('/')
+      if sep:
+        updated[source] = max(updated.get(source, 0), series.updated)
+    if updated:
+      oldest = min(updated, key=updated.get)
+      for name in [name for name in self.series if name.rpartition('/')[0] == oldest]:
+        del self.series[name]
+
+  def _get(self, name, kind):
+    series = self.series.get(name)
+    if series is None:
+      if len(self.series) >= self.max_series:
+        self._evict()
+      series = self.series[name] = Series(kind, self.resolutions)
+    return series
+
+  def add(self, name, value, now=None):
+    """Adds a gauge sample, e.g. a duration."""
+    now = datetime.datetime.now().timestamp() if now is None else now
+    self._get(name, 'gauge').add(value, now)
+
+  def count(self, name, n=1, now=None):
+    """Adds `n` events to a counter, reported as rate per second."""
+    now = datetime.datetime.now().timestamp() if now is None else now
+    self._get(name, 'counter').add(n, now)
+
+  def query(self, resolution, names=None, since=0, now=None, digits=3):
+    """Returns `{name: {kind, rows}}` with `rows` as `[t, value, max]`.
+
+    Only rows with `t >= since` are returned, values are rounded to `digits`.
+    """
+    if resolution not in dict(self.resolutions):
+      raise ValueError(f'Unknown resolution: {resolution}')
+    now = datetime.datetime.now().timestamp() if now is None else now
+    for series in self.series.values():
+      series.advance(now)
+    return {
+        name: dict(kind=series.kind, rows=[
+            (round(t), round(value, digits), round(max_value, digits))
+            for t, value, max_value in series.rows(resolution, since)
+        ])
+        for name, series in self.series.items()
+        if names is None or name in names
+    }
@@ -3,32 +3,21 @@ import ipaddress
 import netifaces
 
 
-
-def find_wireless_interface():
-  for iface in netifaces.interfaces():
-    addrs = netifaces.ifaddresses(iface)
-    if netifaces.AF_INET in addrs:  # Has IPv4
-      inet_info = addrs[netifaces.AF_INET][0]
-      if 'addr' in inet_info:
-        if any(pattern in iface.lower() for pattern in [
-            # e.g. "wlan" on Raspbian, "en" on OS X
-            'wlan', 'en', 'wifi', 'wireless', 'wl',
-        ]):
-          return iface
-  return None
+# e.g. "wlan0" on Raspbian, "en0" on OS X, "end0"/"eth0" for wired interfaces
+INTERFACE_PREFIXES = ('wlan', 'wl', 'en', 'eth', 'wifi')
 
 
-def get_broadcast_addr(interface=None):
-  if interface is None:
-    interface = find_wireless_interface()
-    if not interface:
-      return None
-
-  addrs = netifaces.ifaddresses(interface)
-  if netifaces.AF_INET in addrs:
-    inet_info = addrs[netifaces.AF_INET][0]
-    ip = inet_info['addr']
-    netmask = inet_info['netmask']
-    network = ipaddress.IPv4Network(f'{ip}/{netmask}', strict=False)
-    return str(network.broadcast_address)
-  return None
+def get_broadcast_addrs():
+  """Returns sorted `(interface, broadcast_addr)` for all matching interfaces."""
+  result = set()
+  for iface in netifaces.interfaces():
+    if not iface.lower().startswith(INTERFACE_PREFIXES):
+      continue
+    for inet_info in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+      if 'addr' not in inet_info or 'netmask' not in inet_info:
+        continue
+      network = ipaddress.IPv4Network(f"{inet_info['addr']}/{inet_info['netmask']}", strict=False)
+      if network.is_loopback or network.prefixlen == 32:
+        continue
+      result.add((iface, str(network.broadcast_address)))
+  return sorted(result)
@@ -0,0 +1,185 @@
+"""Binary encodings of the `/data` websocket stream.
+
+Two protocols are supported:
+
+v1 (legacy): One 33 byte message per client per tick: `>L` timestamp, `B`
+  client index, `>7f` gx, gy, gz, rz, r, g, b. This is also the format of the
+  `logs/*.bin` data files.
+
+v2 (compact): One frame per tick carrying all clients. Values are quantized to
+  fixed point integers (see `FIELDS`) and every record is delta encoded against
+  the record with the same client index in the previous frame, written as
+  zigzag varints. Key frames are delta encoded against zero. Differences wrap
+  around at the field's bit width, so decoding is exact. Timestamps wrap around
+  after 2^32 ms (49.71 days).
+
+  `FrameDecoder` mirrors the decoder in `static/types.js`.
+
+  Frame layout:
+
+    B   flags (bit 0: key frame)
+    >L  frame timestamp (ms)
+    B   field mask (bit i set if `FIELDS[i]` is included)
+    B   number of records
+    per record:
+      B        client index
+      varint*  one zigzag varint per component of every included field
+"""
+
+import collections
+import struct
+
+
+SensorRecord = collections.namedtuple('SensorRecord', 't, index, sd, rgb')
+
+# name -> (components, scale, bits, signed)
+FIELDS = collections.OrderedDict(
+    t=(1, 1, 32, False),  # ms
+    gx=(1, 1000, 16, True),  # m/s^2, +-32.7
+    gy=(1, 1000, 16, True),
+    gz=(1, 1000, 16, True),
+    rz=(1, 1000, 16, True),  # rad/s, +-32.7
+    rgb=(3, 255, 8, False),
+)
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+FLAG_KEYFRAME = 1
+T_MASK = 0xffffffff
+
+
+def pack_v1(record):
+  return (
+      struct.pack('>L', record.t & T_MASK)  # 32 bits = 49.71 days of milliseconds
+      + struct.pack('B', record.index)
+      + struct.pack('>7f', record.sd.gx, record.sd.gy, record.sd.gz, record.sd.rz, *record.rgb)
+  )
+
+
+def parse_fields(names):
+  """Returns field mask for comma separated `names` (all fields if empty)."""
+  if not names:
+    return ALL_FIELDS
+  mask = 0
+  for name in names.split(','):
+    name = name.strip()
+    if name not in FIELDS:
+      raise ValueError(f'Unknown field: {name}')
+    mask |= 1 << list(FIELDS).index(name)
+  return mask
+
+
+def _quantize(value, scale, bits, signed):
+  x = round(value * scale)
+  lo, hi = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+  return max(lo, min(hi, x))
+
+
+def _write_varint(out, d):
+  z = 2 * d if d >= 0 else -2 * d - 1  # zigzag
+  while z >= 0x80:
+    out.append((z & 0x7f) | 0x80)
+    z >>= 7
+  out.append(z)
+
+
+class FrameEncoder:
+  """Encodes per-tick frames for a single v2 subscriber.
+
+  Delta encoding is stateful, so every websocket connection needs its own
+  encoder. A key frame is sent first, after `set_fields()`, and then every
+  `keyframe_interval` frames.
+  """
+
+  def __init__(self, mask=ALL_FIELDS, keyframe_interval=60):
+    self.keyframe_interval = keyframe_interval
+    self.set_fields(mask)
+
+  def set_fields(self, mask):
+    self.mask = mask
+    self.specs = [spec for i, spec in enumerate(FIELDS.values()) if mask & (1 << i)]
+    self.prev = {}
+    self.count = 0
+
+  def _values(self, record):
+    values = []
+    for name, (_, scale, bits, signed) in FIELDS.items():
+      if name == 't':
+        components = (record.t & T_MASK,)
+      elif name == 'rgb':
+        components = record.rgb
+      else:
+        components = (getattr(record.sd, name),)
+      values.append([_quantize(c, scale, bits, signed) for c in components])
+    return [v for i, v in enumerate(values) if self.mask & (1 << i)]
+
+  def encode(self, t, records):
+    keyframe = self.count % self.keyframe_interval == 0
+    self.count += 1
+    if keyframe:
+      self.prev = {}
+
+    out = bytearray(struct.pack('>BLBB', FLAG_KEYFRAME if keyframe else 0, t & T_MASK, self.mask, len(records)))
+    for record in records:
+      values = self._values(record)
+      prev = self.prev.get(record.index)
+      out.append(record.index)
+      for i, ((_, _, bits, _), components) in enumerate(zip(self.specs, values)):
+        half, full = 1 << (bits - 1), (1 << bits) - 1
+        for j, v in enumerate(components):
+          p = prev[i][j] if prev else 0
+          _write_varint(out, ((v - p + half) & full) - half)
+      self.prev[record.index] = values
+    return bytes(out)
+
+
+class FrameDecoder:
+  """Decodes frames from `FrameEncoder`, see `FrameDecoder` in `static/types.js`."""
+
+  def __init__(self):
+    self.prev = {}
+
+  def decode(self, data):
+    """Returns `(t, index, gx, gy, gz, rz, r, g, b)` per record.
+
+    Fields that are not included in the frame are 0 (`t`: frame timestamp).
+    """
+    flags, frame_t, mask, n = struct.unpack_from('>BLBB', data)
+    pos = 7
+
+    def read_varint():
+      nonlocal pos
+      z = shift = 0
+      while True:
+        b = data[pos]
+        pos += 1
+        z |= (b & 0x7f) << shift
+        shift += 7
+        if not b & 0x80:
+          return -(z + 1) // 2 if z & 1 else z // 2
+
+    if flags & FLAG_KEYFRAME:
+      self.prev = {}
+    specs = [(name, spec) for i, (name, spec) in enumerate(FIELDS.items()) if mask & (1 << i)]
+    result = []
+    for _ in range(n):
+      index = data[pos]
+      pos += 1
+      prev = self.prev.get(index)
+      fields = {}
+      values = []
+      for i, (name, (components, scale, bits, signed)) in enumerate(specs):
+        quantized = []
+        for j in range(components):
+          v = ((prev[i][j] if prev else 0) + read_varint()) & ((1 << bits) - 1)
+          if signed and v >= 1 << (bits - 1):
+            v -= 1 << bits
+          quantized.append(v)
+        values.append(quantized)
+        fields[name] = [v / scale for v in quantized]
+      self.prev[index] = values
+      result.append((
+          fields['t'][0] if 't' in fields else frame_t, index,
+          *(fields[name][0] if name in fields else 0 for name in ('gx', 'gy', 'gz', 'rz')),
+          *fields.get('rgb', (0, 0, 0)),
+      ))
+    return result
@@ -1,9 +1,21 @@
 """Server converting IMU packets to OSC messages, with web simple app.
 
-0. Announces presence in local network at UDP_BROADCAST_PORT
+0. Announces presence in local network at UDP_BROADCAST_PORT, and answers
+   discovery requests at UDP_DISCOVERY_PORT (see `discovery`).
 1. Listens on UDP_IMU_PORT for raw IMU messages.
 2. Converts data to light OSC UDP messages and sends them to localhost:7770
-3. Async web server at HTTP_PORT with streaming UI.
+3. Async web server at HTTP_PORT with streaming UI and historical metrics
+   (see `metrics`).
+
+With --relay, sensor data is additionally forwarded to peer nodes, and with
+--peer the server receives sensor data from a relaying node instead of 0. and 1.
+(see `cluster`).
+
+1. and 2. are started first, so lights come up as fast as possible after a
+power cycle. The web server (including its imports), log files and 0. are
+initialized concurrently afterwards. Startup timings (ms since process start,
+including interpreter startup and imports) are logged and available in the
+"startup" state.
 """
 
 # https://claude.ai/chat/793e8562-ecef-458d-baee-39f5f397cf61
@@ -12,32 +24,61 @@ import argparse
 import asyncio
 import collections
 import datetime
+import importlib
 import json
 import logging
 import os
 import pathlib
 import socket
 import struct
+import sys
 import tempfile
+import time
 import weakref
 
-import aiofiles
-import aiohttp.web
 
-import algos
-import olad
-import netutils
+
+def _process_age():
+  """Returns seconds since process start.
+
+  Uses the start time from /proc on Linux, and falls back to CPU time used so
+  far elsewhere (startup is mostly CPU bound).
+  """
+  try:
+    with open('/proc/self/stat') as f:
+      # fields after the command name, starttime is field 22
+      starttime = int(f.read().rsplit(')', 1)[1].split()[19])
+    return time.clock_gettime(time.CLOCK_BOOTTIME) - starttime / os.sysconf('SC_CLK_TCK')
+  except (OSError, AttributeError, ValueError, IndexError):
+    times = os.times()
+    return times.user + times.system
+
+
+T_START = time.monotonic() - _process_age()
+
+import algos  # noqa: E402
+import metrics  # noqa: E402
+import olad  # noqa: E402
+import protocol  # noqa: E402
+
+# imported lazily by import_web()
+aiofiles = None
+aiohttp = None
 
 
 HTTP_PORT = 8000
 UDP_IMU_PORT = 9001
 UDP_BROADCAST_PORT = 9002
+UDP_DISCOVERY_PORT = 9003
+UDP_CLUSTER_PORT = 9004
+OSC_PORT = 7770
 
 t0 = datetime.datetime.now().timestamp()
 
 SensorData = collections.namedtuple('SensorData', 'gx, gy, gz, ax, ay, az, rx, ry, rz'.split(', '))
 
 log_file = None
+data_file = None
 
 STATE_FILE = 'state.json'
 state = dict(
@@ -50,6 +91,7 @@ state = dict(
     gradient='hue',
     algorithm='gx_gy',
     param1=1.0, param2=1.0, param3=1.0,
+    startup=dict(imports=round(1000 * (time.monotonic() - T_START))),
 )
 PRESERVED_STATE = {'alpha', 'brigthness', 'device', 'gradient', 'algorithm', 'param1', 'param2', 'param3'}
 serialized = lambda s: {k: v for k, v in s.items() if k in PRESERVED_STATE}  # noqa: E731
@@ -66,24 +108,58 @@ def get_active(addr, ms, limit=1000):
 def parse_args():
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+  parser.add_argument('--sensors', type=int, default=0,
+                      help='Number of expected sensors, announce less often while all are connected')
+  parser.add_argument('--http-port', type=int, default=HTTP_PORT, help='Web server port')
+  parser.add_argument('--osc-port', type=int, default=OSC_PORT, help='olad OSC port on localhost')
+  parser.add_argument('--relay', action='append', default=[], metavar='HOST[:PORT][@IFACE_ADDR]',
+                      help=f'Forward sensor data to peer (unicast or multicast, default port {UDP_CLUSTER_PORT}), '
+                           'sending multicast via the interface with address IFACE_ADDR')
+  parser.add_argument('--peer', metavar='[HOST:]PORT[@IFACE_ADDR]',
+                      help='Receive sensor data from relay instead of sensors (HOST for multicast), '
+                           'joining the multicast group on the interface with address IFACE_ADDR')
   return parser.parse_args()
 
 
-def setup_logging(timestamp, debug=False):
-  global log_file
-  log_file = f'logs/{timestamp}.log'
-
+def setup_logging(debug=False):
   logging.basicConfig(
       level=logging.DEBUG if debug else logging.INFO,
       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
       handlers=[
-          logging.FileHandler(log_file),
           logging.StreamHandler()
       ]
   )
   logging.getLogger(__name__).info(f"Logging level set to: {'DEBUG' if debug else 'INFO'}")
 
 
+async def setup_files(timestamp):
+  global log_file, data_file
+  log_file = f'logs/{timestamp}.log'
+  handler = logging.FileHandler(log_file)
+  handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+  logging.getLogger().addHandler(handler)
+  data_file = await aiofiles.open(f'logs/{timestamp}.bin', 'wb')
+
+
+def mark_startup(name, state_manager):
+  """Records time since process start for startup step `name` (once)."""
+  if name in state['startup']:
+    return
+  state['startup'][name] = round(1000 * (time.monotonic() - T_START))
+  logging.getLogger('startup').info('%s after %dms', name, state['startup'][name])
+  d = dict(startup=state['startup'])
+  asyncio.create_task(state_manager.broadcast(json.dumps(d).encode()))
+
+
+async def import_web():
+  """Imports web dependencies in a thread so the tick loop keeps running."""
+  global aiofiles, aiohttp
+  loop = asyncio.get_running_loop()
+  aiofiles = await loop.run_in_executor(None, importlib.import_module, 'aiofiles')
+  await loop.run_in_executor(None, importlib.import_module, 'aiohttp.web')
+  aiohttp = sys.modules['aiohttp']
+
+
 class UDPProtocol:
   def __init__(self, queue):
     self.queue = queue
@@ -156,6 +232,34 @@ class WebSocketManager:
       await asyncio.gather(*tasks, return_exceptions=True)
 
 
+class DataWebSocketManager(WebSocketManager):
+  """Sends v1 records or v2 frames (see `protocol`) depending on client."""
+
+  def __init__(self, name):
+    super().__init__(name)
+    self.encoders = weakref.WeakKeyDictionary()
+
+  def add_client(self, ws, encoder=None):
+    super().add_client(ws)
+    if encoder:
+      self.encoders[ws] = encoder
+
+  async def broadcast_tick(self, t, records):
+    tasks = []
+    for ws in self.clients:
+      if ws.closed:
+        continue
+      encoder = self.encoders.get(ws)
+      if encoder:
+        tasks.append(asyncio.create_task(ws.send_bytes(encoder.encode(t, records))))
+      else:
+        for record in records:
+          tasks.append(asyncio.create_task(ws.send_bytes(protocol.pack_v1(record))))
+
+    if tasks:
+      await asyncio.gather(*tasks, return_exceptions=True)
+
+
 class BroadcastLoggingHandler(logging.Handler):
 
   def __init__(self, state_manager: WebSocketManager):
@@ -175,17 +279,36 @@ active_ws_connections = set()
 
 
 async def data_ws(request):
+  """Streams sensor data, see `protocol` for the wire formats.
+
+  Query parameters:
+    v: protocol version, 1 (default) or 2.
+    fields: comma separated `protocol.FIELDS` to subscribe to (v2 only).
+    deflate: set to 0 to disable permessage-deflate.
+
+  v2 clients can change their subscription by sending `{"fields": "..."}`.
+  """
   logger = logging.getLogger('DataWs')
-  ws = aiohttp.web.WebSocketResponse()
+  encoder = None
+  if request.query.get('v', '1') == '2':
+    try:
+      encoder = protocol.FrameEncoder(protocol.parse_fields(request.query.get('fields')))
+    except ValueError as e:
+      raise aiohttp.web.HTTPBadRequest(text=str(e))
+  ws = aiohttp.web.WebSocketResponse(compress=request.query.get('deflate', '1') != '0')
   await ws.prepare(request)
 
   data_manager = request.app['data_manager']
-  data_manager.add_client(ws)
+  data_manager.add_client(ws, encoder)
 
   active_ws_connections.add(ws)
   try:
     async for msg in ws:
-      del msg
+      if encoder and msg.type == aiohttp.WSMsgType.TEXT:
+        try:
+          encoder.set_fields(protocol.parse_fields(json.loads(msg.data).get('fields')))
+        except (ValueError, AttributeError) as e:
+          logger.warning(f'Invalid subscription {msg.data!r}: {e}')
   except Exception as e:
     logger.error(f'DataWs error: {e}')
   finally:
@@ -238,19 +361,43 @@ async def logs_get(request):
   )
 
 
+async def metrics_get(request):
+  """Returns metrics, see `metrics.MetricsStore.query()`.
+
+  Query parameters:
+    resolution: seconds per row (default 1).
+    names: comma separated series names (default: all).
+    since: unix timestamp of first row (default: all).
+  """
+  metrics_store = request.app['metrics_store']
+  names = request.query.get('names')
+  try:
+    result = metrics_store.query(
+        int(request.query.get('resolution', 1)),
+        names=names.split(',') if names else None,
+        since=float(request.query.get('since', 0)),
+    )
+  except ValueError as e:
+    raise aiohttp.web.HTTPBadRequest(text=str(e))
+  response = aiohttp.web.json_response(result)
+  response.enable_compression()
+  return response
+
+
 async def index_handler(request):
   raise aiohttp.web.HTTPFound('/static/index.html')
 
 
-async def osc_handler(running, queue, data_manager, state_manager, data_file, hz=60):
+async def osc_handler(running, queue, data_manager, state_manager, discovery_service, relay, metrics_store, osc_port, hz=60):
   logger = logging.getLogger('osc_handler')
   osc_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-  osc_address = ('localhost', 7770)
+  osc_address = ('localhost', osc_port)
 
   emas = {}
   rgbs = {}
   sds = {}
   ts = {}
+  intervals = {}
   active = None
 
   def get_ema(value, ema):
@@ -262,10 +409,25 @@ async def osc_handler(running, queue, data_manager, state_manager, data_file, hz
 
     # first update rgbs etc from sensor data
     updated = set()
+    relayed = []
     while not queue.empty():
       t, addr, sd = await queue.get()
+      mark_startup('first_packet', state_manager)
+      if discovery_service:
+        discovery_service.seen(addr)
+      if relay:
+        relayed.append((t, addr, sd))
+      # by IP, since sensors use a new port when reconnecting
+      ip = addr.rsplit(':', 1)[0]
+      metrics_store.count(f'{ip}/packets', now=loop_t0)
+      if addr in ts:
+        interval = t - ts[addr]
+        if addr in intervals:
+          metrics_store.add(f'{ip}/jitter_ms', abs(interval - intervals[addr]), now=loop_t0)
+        intervals[addr] = interval
       if addr in updated:
         logger.warning('discarding message from %s', addr)
+        metrics_store.count(f'{ip}/dropped', now=loop_t0)
       updated.add(addr)
 
       if addr not in state['clients']:
@@ -289,31 +451,41 @@ async def osc_handler(running, queue, data_manager, state_manager, data_file, hz
         d = dict(active=state['active'])
         asyncio.create_task(state_manager.broadcast(json.dumps(d).encode()))
 
+    if relayed:
+      relay.send(int(1000 * (datetime.datetime.now().timestamp() - t0)), relayed)
+
     # then sync update of emas, ws, and olad if active sensor
+    records = []
     for addr, sd in sds.items():
       rgb = rgbs[addr]
       rgb = emas[addr] = tuple(map(get_ema, rgb, emas.get(addr, rgb)))
-      t = ts[addr]
 
-      ws_msg = struct.pack('>L', t)  # 32 bits = 49.71 days of milliseconds
-      ws_msg += struct.pack('B', state['clients'].index(addr))
-      ws_msg += struct.pack('>7f', sd.gx, sd.gy, sd.gz, sd.rz, *rgb)
-      asyncio.create_task(data_manager.broadcast(ws_msg))
+      record = protocol.SensorRecord(ts[addr], state['clients'].index(addr), sd, rgb)
+      records.append(record)
       if data_file:
-        asyncio.create_task(data_file.write(ws_msg))
+        asyncio.create_task(data_file.write(protocol.pack_v1(record)))
 
       if active == addr:
         msg = olad.to_osc(*rgb, brightness=state['brightness'], device=state['device'])
         try:
           osc_socket.sendto(msg, osc_address)
+          mark_startup('first_frame', state_manager)
+          metrics_store.count('osc', now=loop_t0)
         except Exception as e:
           logger.error(f'Error forwarding OSC packet: {e}')
 
-    wait_dt = 1 / hz - (datetime.datetime.now().timestamp() - loop_t0)
+    if records:
+      t = int(1000 * (datetime.datetime.now().timestamp() - t0))
+      asyncio.create_task(data_manager.broadcast_tick(t, records))
+
+    work_dt = datetime.datetime.now().timestamp() - loop_t0
+    metrics_store.add('tick_ms', work_dt * 1e3, now=loop_t0)
+    wait_dt = 1 / hz - work_dt
     if wait_dt > 0:
       await asyncio.sleep(wait_dt)
     else:
       logger.warning('wait_dt = %.2fms < 0', wait_dt * 1e3)
+      metrics_store.count('tick_overruns', now=loop_t0)
 
   logger.inf('stopping')
 
@@ -325,22 +497,9 @@ async def osc_handler(running, queue, data_manager, state_manager, data_file, hz
 
 async def periodic_handler(running):
   logger = logging.getLogger('periodic_handler')
-  broadcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-  broadcast_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-  broadcast_sock.setblocking(False)
-
-  broadcast_addr = netutils.get_broadcast_addr()
-  if not broadcast_addr:
-    logger.error('No valid broadcast address found')
-    return
-  logger.info('Using broadcast address %s', broadcast_addr)
 
   try:
     while running.is_set():
-      msg = b'PANTONE1'
-      broadcast_sock.sendto(msg, (broadcast_addr, UDP_BROADCAST_PORT))
-      logger.debug(f'Broadcast ping {msg} sent')
-
       with tempfile.NamedTemporaryFile(mode='w', delete=False, dir=os.path.dirname(STATE_FILE)) as tmp:
         tmp_name = tmp.name
         json.dump(serialized(state), tmp, indent=2)
@@ -352,17 +511,46 @@ async def periodic_handler(running):
 
     logger.info('stopping')
   except Exception as e:
-    logger.error(f"Broadcast error: {e}")
-    broadcast_sock.close()
+    logger.error(f"Periodic error: {e}")
+
+
+async def start_web(timestamp, data_manager, state_manager, metrics_store, http_port):
+  """Starts web server and file logging, returns `AppRunner`."""
+  await import_web()
+  mark_startup('web_imports', state_manager)
+  await setup_files(timestamp)
+
+  app = aiohttp.web.Application()
+  app['data_manager'] = data_manager
+  app['state_manager'] = state_manager
+  app['metrics_store'] = metrics_store
+  app.router.add_get('/', index_handler)
+  app.router.add_get('/logs', logs_get)
+  app.router.add_get('/metrics', metrics_get)
+  app.router.add_get('/state', state_ws)
+  app.router.add_post('/state', state_post)
+  app.router.add_get('/data', data_ws)
+  app.router.add_static('/static', pathlib.Path('static'))
+
+  app_runner = aiohttp.web.AppRunner(app)
+  await app_runner.setup()
+  site = aiohttp.web.TCPSite(app_runner, '0.0.0.0', http_port)
+  try:
+    await site.start()
+  except BaseException:
+    await app_runner.cleanup()
+    raise
+  mark_startup('web', state_manager)
+  return app_runner
 
 
 async def main():
   args = parse_args()
 
   timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-  setup_logging(timestamp, debug=args.debug)
+  setup_logging(debug=args.debug)
   logger = logging.getLogger(__name__)
-  logger.info('Starting server')
+  logger.info('Starting server (imports done %dms after process start)', state['startup']['imports'])
 
   if os.path.exists(STATE_FILE):
     logger.info('Loading state from %s', STATE_FILE)
@@ -371,54 +559,77 @@ async def main():
     except json.JSONDecodeError as e:
       logger.error('Could not load state: %s', e)
 
-  data_file = await aiofiles.open(f'logs/{timestamp}.bin', 'wb')
-
-  data_manager = WebSocketManager('data')
+  data_manager = DataWebSocketManager('data')
   state_manager = WebSocketManager('state')
 
   logging.getLogger().addHandler(BroadcastLoggingHandler(state_manager))
 
-  app = aiohttp.web.Application()
-  app['data_manager'] = data_manager
-  app['state_manager'] = state_manager
-  app.router.add_get('/', index_handler)
-  app.router.add_get('/logs', logs_get)
-  app.router.add_get('/state', state_ws)
-  app.router.add_post('/state', state_post)
-  app.router.add_get('/data', data_ws)
-  app.router.add_static('/static', pathlib.Path('static'))
-
   loop = asyncio.get_event_loop()
   queue = asyncio.Queue()
 
-  transport, protocol = await loop.create_datagram_endpoint(
-      lambda: UDPProtocol(queue),
-      local_addr=('0.0.0.0', UDP_IMU_PORT)
-  )
+  if args.peer or args.relay:
+    import cluster
+
+  if args.peer:
+    host, port, interface = cluster.parse_addr(args.peer, UDP_CLUSTER_PORT)
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: cluster.PeerProtocol(
+            lambda t, addr, values: queue.put_nowait((t, addr, SensorData(*values))),
+            clock=lambda: int(1000 * (datetime.datetime.now().timestamp() - t0)),
+        ),
+        sock=cluster.create_peer_socket(host, port, interface),
+    )
+    discovery_service = None
+  else:
+    import discovery
+
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: UDPProtocol(queue),
+        local_addr=('0.0.0.0', UDP_IMU_PORT)
+    )
+    discovery_service = discovery.DiscoveryService(
+        UDP_BROADCAST_PORT, UDP_DISCOVERY_PORT,
+        expected=args.sensors,
+        on_announce=lambda: mark_startup('discovery', state_manager),
+    )
   del protocol
+  mark_startup('udp', state_manager)
 
-  app_runner = aiohttp.web.AppRunner(app)
-  await app_runner.setup()
-  site = aiohttp.web.TCPSite(app_runner, '0.0.0.0', HTTP_PORT)
-  await site.start()
+  metrics_store = metrics.MetricsStore()
 
-  logger.info('All servers started')
+  relay = None
+  if args.relay:
+    relay = cluster.Relay([cluster.parse_addr(target, UDP_CLUSTER_PORT) for target in args.relay])
 
   running = asyncio.Event()
   running.set()
+  def web_started(task):
+    # the web server is optional: if it fails to start, keep sending OSC
+    if not task.cancelled() and task.exception():
+      logger.error('Could not start web server, continuing without it', exc_info=task.exception())
+
+  web_task = asyncio.create_task(start_web(timestamp, data_manager, state_manager, metrics_store, args.http_port))
+  web_task.add_done_callback(web_started)
   try:
     await asyncio.gather(
         asyncio.Event().wait(),  # run forever
+        osc_handler(running, queue, data_manager, state_manager, discovery_service, relay, metrics_store, args.osc_port),
+        *([discovery_service.run(running)] if discovery_service else []),
         periodic_handler(running),
-        osc_handler(running, queue, data_manager, state_manager, data_file),
     )
   finally:
     running.clear()
     transport.close()
+    if relay:
+      relay.close()
     for ws in active_ws_connections.copy():
         await ws.close(code=aiohttp.WSCloseCode.GOING_AWAY,  message='Server shutdown')
-    await app_runner.cleanup()
-    await data_file.close()
+    if web_task.done() and not web_task.cancelled() and not web_task.exception():
+      await web_task.result().cleanup()
+    else:
+      web_task.cancel()
+    if data_file:
+      await data_file.close()
     logger.info('Server shutdown complete')
 
 
@@ -3,12 +3,14 @@
 import { NetworkManager } from './network.js';
 import { Plot } from './plot.js';
 import Logs from './logs.js';
+import Metrics from './metrics.js';
 import StateManager from './state.js';
 import { setEmojiFavicon } from './favicon.js';
 
-const network = new NetworkManager();
+const network = new NetworkManager(new URLSearchParams(location.search).get('fields') ?? undefined);
 const logs = new Logs(/** @type {HTMLDivElement} */ (document.getElementById('logs')));
 const stateManager = new StateManager(/** @type {HTMLElement} */ (document.getElementById('state')), logs);
+new Metrics(/** @type {HTMLElement} */ (document.getElementById('metrics')));
 const plotsDiv = /** @type {HTMLDivElement} */ (document.getElementById('plots'));
 
 /** @type {Map<String, Plot>} */
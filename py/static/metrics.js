@@ -0,0 +1,148 @@
+// @ts-check
+
+/**
+ * @typedef {Object} Series
+ * @property {'gauge'|'counter'} kind
+ * @property {[t: number, value: number, max: number][]} rows
+ */
+
+/**
+ * Seconds per row and number of rows, see `RESOLUTIONS` in `py/metrics.py`.
+ * @type {[resolution: number, size: number][]}
+ */
+const RESOLUTIONS = [[1, 300], [10, 360], [60, 1440]];
+
+/** Renders historical charts from the `/metrics` endpoint. */
+class Metrics {
+  /** @type {HTMLElement} */
+  #element;
+  /** @type {HTMLSelectElement} */
+  #select;
+  /** @type {HTMLDivElement} */
+  #charts;
+  /** @type {number|undefined} */
+  #timeout;
+  /** @type {Record<string, Series>} */
+  #metrics = {};
+  /** @type {number|undefined} */
+  #resolution;
+
+  /**
+   * @param {HTMLElement} targetElement
+   */
+  constructor(targetElement) {
+    this.#element = targetElement;
+    this.#element.innerHTML = `
+      <label>metrics resolution:</label>
+      <select>
+        ${RESOLUTIONS.map(([res]) => `<option value="${res}">${res}s</option>`).join('')}
+      </select>
+      <div class="charts"></div>
+    `;
+    this.#select = /** @type {HTMLSelectElement} */ (this.#element.querySelector('select'));
+    this.#charts = /** @type {HTMLDivElement} */ (this.#element.querySelector('.charts'));
+    this.#select.addEventListener('change', () => this.update());
+    this.update();
+  }
+
+  /** Fetches rows added since the last update and appends them. */
+  async update() {
+    clearTimeout(this.#timeout);
+    const resolution = parseInt(this.#select.value);
+    if (resolution !== this.#resolution) {
+      this.#resolution = resolution;
+      this.#metrics = {};
+    }
+    const size = RESOLUTIONS.find(([res]) => res === resolution)?.[1] ?? 0;
+    const last = Math.max(0, ...Object.values(this.#metrics).map(
+        series => series.rows.length ? series.rows[series.rows.length - 1][0] : 0));
+    const params = new URLSearchParams({resolution: `${resolution}`});
+    if (last) params.set('since', `${last + resolution}`);
+    try {
+      const response = await fetch(`/metrics?${params}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      /** @type {Record<string, Series>} */
+      const metrics = await response.json();
+      if (resolution === this.#resolution) {
+        for (const [name, series] of Object.entries(metrics)) {
+          series.rows = (this.#metrics[name]?.rows ?? []).concat(series.rows).slice(-size);
+        }
+        // series missing from the response were evicted
+        this.#metrics = metrics;
+        this.render(metrics);
+      }
+    } catch (error) {
+      console.error('Failed to fetch metrics:', error);
+    }
+    // a resolution change during the fetch already started a new update
+    if (resolution === this.#resolution) {
+      this.#timeout = setTimeout(() => this.update(), 1000 * Math.max(2, resolution));
+    }
+  }
+
+  /**
+   * @param {Record<string, Series>} metrics
+   */
+  render(metrics) {
+    const names = Object.keys(metrics).sort();
+    for (const chart of Array.from(this.#charts.children)) {
+      const name = chart.getAttribute('data-name');
+      if (!name || !(name in metrics)) chart.remove();
+    }
+    for (const name of names) {
+      let chart = /** @type {HTMLDivElement|null} */ (this.#charts.querySelector(`[data-name="${name}"]`));
+      if (!chart) {
+        chart = document.createElement('div');
+        chart.className = 'chart';
+        chart.setAttribute('data-name', name);
+        chart.innerHTML = `<div class="label"></div><canvas height="60"></canvas>`;
+        this.#charts.append(chart);
+      }
+      this.#draw(chart, name, metrics[name]);
+    }
+  }
+
+  /**
+   * @param {HTMLDivElement} chart
+   * @param {string} name
+   * @param {Series} series
+   */
+  #draw(chart, name, series) {
+    const label = /** @type {HTMLDivElement} */ (chart.querySelector('.label'));
+    const canvas = /** @type {HTMLCanvasElement} */ (chart.querySelector('canvas'));
+    const ctx = /** @type {CanvasRenderingContext2D} */ (canvas.getContext('2d'));
+    canvas.width = canvas.parentElement?.clientWidth ?? canvas.width;
+    ctx.fillStyle = 'black';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+
+    const rows = series.rows;
+    const unit = series.kind === 'counter' ? '/s' : '';
+    if (!rows.length) {
+      label.textContent = `${name}: -`;
+      return;
+    }
+    const max = Math.max(...rows.map(row => row[2]));
+    const last = rows[rows.length - 1][1];
+    label.textContent = `${name}: ${last.toFixed(2)}${unit} (max ${max.toFixed(2)}${unit})`;
+
+    const t0 = rows[0][0];
+    const dt = Math.max(1, rows[rows.length - 1][0] - t0);
+    /** @param {number} column @param {string} color */
+    const line = (column, color) => {
+      ctx.strokeStyle = color;
+      ctx.beginPath();
+      rows.forEach((row, i) => {
+        const x = (row[0] - t0) / dt * (canvas.width - 1);
+        const y = canvas.height - 1 - (max ? row[column] / max : 0) * (canvas.height - 2);
+        if (i) ctx.lineTo(x, y); else ctx.moveTo(x, y);
+      });
+      ctx.stroke();
+    };
+    if (series.kind === 'gauge') line(2, '#844');
+    line(1, '#0f0');
+  }
+}
+
+export default Metrics;
@@ -1,6 +1,6 @@
 // @ts-check
 
-import { parseSensorData } from './types.js';
+import { FrameDecoder } from './types.js';
 
 /** @typedef {(data: import('./types.js').SensorData) => void} DataCallback */
 /** @typedef {() => void} CloseCallback */
@@ -13,25 +13,37 @@ export class NetworkManager {
   #closeCallbacks = [];
   /** @type {WebSocket} */
   #ws;
+  #decoder = new FrameDecoder();
 
-  constructor() {
-    this.#ws = this.#createWebSocket();
+  /**
+   * @param {string} [fields] Comma separated fields to subscribe to (default: all)
+   */
+  constructor(fields) {
+    this.#ws = this.#createWebSocket(fields);
     this.setupHandlers();
   }
 
-  /** @returns {WebSocket} */
-  #createWebSocket() {
+  /**
+   * @param {string} [fields]
+   * @returns {WebSocket}
+   */
+  #createWebSocket(fields) {
     const protocol = {
       "http:": "ws:",
       "https:": "wss:",
     }[location.protocol];
-    return new WebSocket(`${protocol}//${location.host}/data`);
+    const params = new URLSearchParams({v: '2'});
+    if (fields) params.set('fields', fields);
+    const ws = new WebSocket(`${protocol}//${location.host}/data?${params}`);
+    ws.binaryType = 'arraybuffer';
+    return ws;
   }
 
   setupHandlers() {
-    this.#ws.onmessage = async (event) => {
-      const data = parseSensorData(await event.data.arrayBuffer());
-      this.#dataCallbacks.forEach(cb => cb(data));
+    this.#ws.onmessage = (event) => {
+      for (const data of this.#decoder.decode(event.data)) {
+        this.#dataCallbacks.forEach(cb => cb(data));
+      }
     };
 
     this.#ws.onclose = () => {
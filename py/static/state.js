@@ -15,6 +15,7 @@ import Logs from './logs.js';
  * @property {number} param1
  * @property {number} param2
  * @property {number} param3
+ * @property {Record<String, number>} startup
  * @property {String} log
  */
 
@@ -25,6 +26,7 @@ const INITIAL_STATE = {
   device: '?',
   gradient: 'hue',
   algorithm: '?', param1: 1.0, param2: 1.0, param3: 1.0,
+  startup: {},
 };
 
 const ALGORITHMS = ['gx_gy', 'gy_gz', 'gz_gx', 'z_rot', 'gx_gy_gz'];
@@ -150,6 +152,11 @@ class StateManager {
           <span>${this.state.active}</span>
         </div>
 
+        <div class="state-item">
+          <label>startup (since process start):</label>
+          <span>${Object.entries(this.state.startup).map(([k, v]) => `${k}=${v}ms`).join(' ')}</span>
+        </div>
+
         ${slider('alpha')}
         ${slider('brightness')}
 
@@ -15,26 +15,76 @@
  * ]} SensorData */
 
 /**
- * Parses a a SensorData buffer in big-endian format
- * @param {ArrayBuffer} buffer - Buffer containing one uint32 followed by float32 values
- * @returns {SensorData} Parsed data
- * @throws {Error} If buffer length is incorrect
+ * Field specs of the compact (v2) protocol, see `py/protocol.py`.
+ * @type {[name: string, components: number, scale: number, bits: number, signed: boolean][]}
  */
-export function parseSensorData(buffer) {
-  const expectedBytes = 4 + 1 + (7 * 4);
-  if (buffer.byteLength !== expectedBytes) {
-    throw new Error(`Buffer must be exactly ${expectedBytes} bytes (got ${buffer.byteLength})`);
-  }
+export const FIELDS = [
+  ['t', 1, 1, 32, false],
+  ['gx', 1, 1000, 16, true],
+  ['gy', 1, 1000, 16, true],
+  ['gz', 1, 1000, 16, true],
+  ['rz', 1, 1000, 16, true],
+  ['rgb', 3, 255, 8, false],
+];
 
-  const dataView = new DataView(buffer);
-  const result = new Array(9);
+/** Decodes delta encoded v2 frames into SensorData records. */
+export class FrameDecoder {
+  /** @type {Map<number, number[][]>} */
+  #prev = new Map();
 
-  result[0] = dataView.getUint32(0, false);
-  result[1] = dataView.getUint8(4);
+  /**
+   * @param {ArrayBuffer} buffer - One frame as sent by `protocol.FrameEncoder`
+   * @returns {SensorData[]} One record per client; unsubscribed fields are 0
+   */
+  decode(buffer) {
+    const bytes = new Uint8Array(buffer);
+    const dataView = new DataView(buffer);
+    const keyframe = bytes[0] & 1;
+    const frameT = dataView.getUint32(1, false);
+    const mask = bytes[5];
+    const n = bytes[6];
+    let pos = 7;
 
-  for (let i = 0; i < 7; i++) {
-    result[i + 2] = dataView.getFloat32(5 + (i * 4), false);
-  }
+    const readVarint = () => {
+      let z = 0, mul = 1, b;
+      do {
+        b = bytes[pos++];
+        z += (b & 0x7f) * mul;
+        mul *= 128;
+      } while (b & 0x80);
+      return z % 2 ? -(z + 1) / 2 : z / 2;
+    };
 
-  return /** @type {SensorData} */ (result);
+    if (keyframe) this.#prev.clear();
+    const specs = FIELDS.filter((_, i) => mask & (1 << i));
+    /** @type {SensorData[]} */
+    const result = [];
+    for (let k = 0; k < n; k++) {
+      const index = bytes[pos++];
+      const prev = this.#prev.get(index);
+      /** @type {Record<string, number[]>} */
+      const fields = {};
+      const values = specs.map(([name, components, scale, bits, signed], i) => {
+        const full = 2 ** bits;
+        const quantized = [];
+        for (let j = 0; j < components; j++) {
+          const p = prev ? prev[i][j] : 0;
+          let v = (((p + readVarint()) % full) + full) % full;
+          if (signed && v >= full / 2) v -= full;
+          quantized.push(v);
+        }
+        fields[name] = quantized.map(v => v / scale);
+        return quantized;
+      });
+      this.#prev.set(index, values);
+
+      const [r, g, b] = fields.rgb ?? [0, 0, 0];
+      result.push(/** @type {SensorData} */ ([
+        fields.t?.[0] ?? frameT, index,
+        fields.gx?.[0] ?? 0, fields.gy?.[0] ?? 0, fields.gz?.[0] ?? 0, fields.rz?.[0] ?? 0,
+        r, g, b,
+      ]));
+    }
+    return result;
+  }
 }
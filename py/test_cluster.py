@@ -0,0 +1,137 @@
+import socket
+
+import pytest
+
+import cluster
+
+
+VALUES = [9.81, -0.5, 0.125, 0.0, 1.0, -1.0, 0.01, -3.0, 2.5]
+
+
+class Peer:
+  """`PeerProtocol` with a fake clock, collecting records."""
+
+  def __init__(self):
+    self.now = 0
+    self.records = []
+    self.protocol = cluster.PeerProtocol(
+        lambda t, addr, values: self.records.append((t, addr, values)),
+        clock=lambda: self.now,
+    )
+
+  def receive(self, frame, now):
+    self.now = now
+    self.protocol.datagram_received(frame, ('10.0.0.1', 9004))
+
+
+def test_parse_addr():
+  assert cluster.parse_addr('239.255.0.4', 9004) == ('239.255.0.4', 9004, None)
+  assert cluster.parse_addr('10.0.0.2:9005', 9004) == ('10.0.0.2', 9005, None)
+  assert cluster.parse_addr('9005', 9004) == ('', 9005, None)
+  assert cluster.parse_addr('239.255.0.4@10.0.0.1', 9004) == ('239.255.0.4', 9004, '10.0.0.1')
+  assert cluster.parse_addr('239.255.0.4:9005@10.0.0.1', 9004) == ('239.255.0.4', 9005, '10.0.0.1')
+  with pytest.raises(ValueError):
+    cluster.parse_addr('239.255.0.4@eth0', 9004)
+
+
+def test_frame_round_trip():
+  records = [(990, '10.0.0.2:40000', VALUES), (1000, '10.0.0.3:1', [1e6, -1e6] + [0.0] * 7)]
+  frame = cluster.encode_frame(7, 42, 1000, records)
+  assert len(frame) == cluster.HEADER.size + 2 * cluster.RECORD.size
+  session, seq, t, decoded = cluster.decode_frame(frame)
+  assert (session, seq, t) == (7, 42, 1000)
+  assert [(age, addr) for age, addr, _ in decoded] == [(10, '10.0.0.2:40000'), (0, '10.0.0.3:1')]
+  assert decoded[0][2] == pytest.approx(VALUES, rel=1e-3, abs=1e-3)
+  assert decoded[1][2][:2] == [cluster.FLOAT16_MAX, -cluster.FLOAT16_MAX]
+
+
+def test_age_is_clamped():
+  frame = cluster.encode_frame(0, 0, 100_000, [(0, '10.0.0.2:1', VALUES), (100_001, '10.0.0.2:1', VALUES)])
+  assert [age for age, _, _ in cluster.decode_frame(frame)[3]] == [0xffff, 0]
+
+
+def test_invalid_frames():
+  frame = cluster.encode_frame(0, 0, 0, [(0, '10.0.0.2:1', VALUES)])
+  with pytest.raises(ValueError):
+    cluster.decode_frame(b'XXXX' + frame[4:])
+  with pytest.raises(ValueError):
+    cluster.decode_frame(frame[:-1])
+  peer = Peer()
+  peer.receive(frame[:-1], 0)
+  assert peer.records == [] and peer.protocol.stats['received'] == 0
+
+
+def test_sequencing():
+  peer = Peer()
+  frame = lambda seq, session=1: cluster.encode_frame(session, seq, 0, [])  # noqa: E731
+  for seq in (0, 1, 4, 4, 3, 5):
+    peer.receive(frame(seq), 0)
+  assert peer.protocol.stats == dict(received=4, lost=2, dropped=2, offset=0)
+
+  # sequence numbers wrap around
+  for seq in (0xfffffffe, 0xffffffff, 0, 1):
+    peer.receive(frame(seq, session=2), 0)
+  assert peer.protocol.stats['received'] == 8
+  assert peer.protocol.stats['lost'] == 2
+
+  # restarted relay starts again at 0
+  peer.receive(frame(0, session=3), 0)
+  assert peer.protocol.stats['received'] == 9
+  assert peer.protocol.stats['dropped'] == 2
+
+
+def test_clock_offset():
+  peer = Peer()
+  # sender clock is 5000ms ahead, network delay between 3 and 20ms
+  for seq, delay in enumerate((20, 3, 10, 7)):
+    t = 10_000 + 50 * seq
+    peer.receive(cluster.encode_frame(1, seq, t, [(t - 15, '10.0.0.2:1', VALUES)]), t - 5000 + delay)
+  assert peer.protocol.stats['offset'] == -5000 + 3
+  # converted to local time, using the offset known when received
+  assert [t for t, _, _ in peer.records] == [
+      10_000 - 15 - 5000 + 20,
+      10_050 - 15 - 5000 + 3,
+      10_100 - 15 - 5000 + 3,
+      10_150 - 15 - 5000 + 3,
+  ]
+
+
+def test_relay_splits_large_batches():
+  receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  receiver.bind(('127.0.0.1', 0))
+  receiver.settimeout(1)
+  relay = cluster.Relay([(*receiver.getsockname(), None)])
+  try:
+    relay.send(1000, [(1000, f'10.0.0.{i % 250}:{i}', VALUES) for i in range(300)])
+    frames = [cluster.decode_frame(receiver.recv(65536)) for _ in range(2)]
+  finally:
+    relay.close()
+    receiver.close()
+  assert [(seq, len(records)) for _, seq, _, records in frames] == [(0, 255), (1, 45)]
+  assert relay.seq == 2
+
+
+def test_multicast_via_interface():
+  try:
+    peer = cluster.create_peer_socket('239.255.0.4', 0, '127.0.0.1')
+  except OSError as e:
+    pytest.skip(f'No multicast on loopback: {e}')
+  peer.settimeout(1)
+  port = peer.getsockname()[1]
+  relay = cluster.Relay([('239.255.0.4', port, '127.0.0.1'), ('127.0.0.1', port, None)])
+  try:
+    assert sorted(relay.socks, key=str) == ['127.0.0.1', None]
+    relay.send(1000, [(1000, '10.0.0.2:1', VALUES)])
+    assert [cluster.decode_frame(peer.recv(65536))[1] for _ in range(2)] == [0, 0]
+  finally:
+    relay.close()
+    peer.close()
+
+
+def test_unicast_peer_port_is_exclusive():
+  sock = cluster.create_peer_socket('127.0.0.1', 0)
+  try:
+    with pytest.raises(OSError):
+      cluster.create_peer_socket('127.0.0.1', sock.getsockname()[1])
+  finally:
+    sock.close()
@@ -0,0 +1,100 @@
+import asyncio
+import socket
+import sys
+
+import pytest
+
+import discovery
+import netutils
+
+
+@pytest.fixture
+def service():
+  service = discovery.DiscoveryService(0, 0, expected=2, timeout=2.0, forget=60.0)
+  yield service
+  service.sock.close()
+
+
+def test_reconnect_with_new_port(service):
+  service.seen('10.0.0.2:40000', now=100)
+  service.seen('10.0.0.3:40000', now=100)
+  service._update_connected(101)
+  assert service.all_connected()
+
+  # 10.0.0.2 reconnects from a new port
+  service.seen('10.0.0.2:40001', now=102)
+  service.seen('10.0.0.3:40000', now=102)
+  service._update_connected(102.5)
+  assert service.all_connected()
+
+
+def test_lost_sensors_are_forgotten(service):
+  service.seen('10.0.0.2:40000', now=100)
+  service.seen('10.0.0.3:40000', now=100)
+  service._update_connected(100)
+  for t in range(101, 200):
+    service.seen('10.0.0.2:40000', now=t)
+    service._update_connected(t)
+    assert service.all_connected() == (t < 102)
+  # 10.0.0.3 is forgotten after it was silent for `forget` seconds
+  assert set(service.last_seen) == {'10.0.0.2'}
+
+
+def test_backoff_requires_expected(service):
+  service.expected = 0
+  service.seen('10.0.0.2:40000', now=100)
+  service._update_connected(100)
+  assert not service.all_connected()
+
+
+def test_lost_sensor_triggers_burst(service):
+  service.seen('10.0.0.2:40000', now=100)
+  service._update_connected(100)
+  service._next_send = 1000
+  service._update_connected(103)
+  assert service._next_send == 0
+  assert service._burst == list(discovery.BURST)
+
+
+def test_deadline_includes_possible_disconnect(service):
+  service._next_send = service._next_refresh = 1000
+  service.seen('10.0.0.2:40000', now=100)
+  service._update_connected(100)
+  assert service._deadline() == 102
+
+
+def test_run_survives_errors(service, monkeypatch):
+  def fail():
+    raise ValueError('no interfaces')
+  monkeypatch.setattr(netutils, 'get_broadcast_addrs', fail)
+
+  blocker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  blocker.bind(('0.0.0.0', 0))
+  service.request_port = blocker.getsockname()[1]
+
+  async def run():
+    running = asyncio.Event()
+    running.set()
+    with pytest.raises(asyncio.TimeoutError):
+      await asyncio.wait_for(service.run(running), 0.2)
+
+  try:
+    asyncio.run(run())
+  finally:
+    blocker.close()
+  assert service.interfaces == []
+
+
+def test_run_survives_unexpected_errors(service, monkeypatch):
+  monkeypatch.setitem(sys.modules, 'netutils', None)  # import raises ImportError
+  monkeypatch.setattr(service, '_announce', lambda: 1 / 0)
+  service.request_port = 0
+
+  async def run():
+    running = asyncio.Event()
+    running.set()
+    with pytest.raises(asyncio.TimeoutError):
+      await asyncio.wait_for(service.run(running), 0.2)
+
+  asyncio.run(run())
+  assert service.interfaces == []
@@ -0,0 +1,83 @@
+import pytest
+
+import metrics
+
+
+RESOLUTIONS = ((1, 5), (10, 3))
+
+
+def rows(store, name, resolution=1, now=None, since=0):
+  return [tuple(row) for row in store.query(resolution, names=[name], since=since, now=now)[name]['rows']]
+
+
+def test_ring_buffer_wraps():
+  buffer = metrics.RingBuffer(3)
+  assert list(buffer.rows()) == []
+  for t in range(5):
+    buffer.append(t, 10 * t, 100 * t)
+  assert list(buffer.rows()) == [(2, 20, 200), (3, 30, 300), (4, 40, 400)]
+  assert list(buffer.rows(since=4)) == [(4, 40, 400)]
+
+
+def test_gauge_mean_and_max():
+  store = metrics.MetricsStore(RESOLUTIONS)
+  for t, value in ((100.0, 1), (100.5, 3), (101.2, 5)):
+    store.add('g', value, now=t)
+  assert rows(store, 'g', now=101.9) == [(100, 2, 3)]
+  assert rows(store, 'g', now=102.0) == [(100, 2, 3), (101, 5, 5)]
+  assert rows(store, 'g', resolution=10, now=110) == [(100, 3, 5)]
+
+
+def test_counter_rate():
+  store = metrics.MetricsStore(RESOLUTIONS)
+  for i in range(60):
+    store.count('c', now=100 + i / 20)
+  assert rows(store, 'c', now=103) == [(100, 20, 20), (101, 20, 20), (102, 20, 20)]
+  assert rows(store, 'c', resolution=10, now=110) == [(100, 6, 6)]
+
+
+def test_silent_series_are_zero_filled():
+  store = metrics.MetricsStore(RESOLUTIONS)
+  for i in range(20):
+    store.count('c', now=100 + i / 10)
+    store.add('g', 7, now=100 + i / 10)
+  assert rows(store, 'c', now=104) == [(100, 10, 10), (101, 10, 10), (102, 0, 0), (103, 0, 0)]
+  assert rows(store, 'g', now=104)[-1] == (103, 0, 0)
+  # no data for longer than the buffer holds
+  assert rows(store, 'c', now=190) == [(185 + i, 0, 0) for i in range(5)]
+  assert rows(store, 'c', resolution=10, now=190) == [(160, 0, 0), (170, 0, 0), (180, 0, 0)]
+
+
+def test_samples_after_gap():
+  store = metrics.MetricsStore(RESOLUTIONS)
+  store.count('c', now=100)
+  store.count('c', now=103.5)
+  store.count('c', now=103.6)
+  assert rows(store, 'c', now=104) == [(100, 1, 1), (101, 0, 0), (102, 0, 0), (103, 2, 2)]
+
+
+def test_query_since_rounds_values():
+  store = metrics.MetricsStore(RESOLUTIONS)
+  for i in range(3):
+    store.add('g', 1 / 3, now=100.5 + i)
+  assert rows(store, 'g', now=103) == [(100, 0.333, 0.333), (101, 0.333, 0.333), (102, 0.333, 0.333)]
+  assert rows(store, 'g', now=104, since=102 + 1) == [(103, 0, 0)]
+  assert rows(store, 'g', now=104, since=104) == []
+
+
+def test_max_series_evicts_least_recently_updated_source():
+  store = metrics.MetricsStore(RESOLUTIONS, max_series=4)
+  store.add('tick', 1, now=100)
+  store.add('a/packets', 1, now=101)
+  store.add('a/jitter', 1, now=101)
+  store.add('b/packets', 1, now=102)
+  store.add('a/packets', 1, now=103)
+  store.add('c/packets', 1, now=104)
+  assert sorted(store.query(1, now=105)) == ['a/jitter', 'a/packets', 'c/packets', 'tick']
+  store.add('d/packets', 1, now=105)
+  assert sorted(store.query(1, now=106)) == ['c/packets', 'd/packets', 'tick']
+
+
+def test_unknown_resolution():
+  with pytest.raises(ValueError):
+    metrics.MetricsStore(RESOLUTIONS).query(60)
@@ -0,0 +1,145 @@
+import collections
+import json
+import pathlib
+import shutil
+import subprocess
+
+import pytest
+
+import protocol
+
+
+SensorData = collections.namedtuple('SensorData', 'gx, gy, gz, ax, ay, az, rx, ry, rz')
+
+
+def record(t, index, g=(0.0, 0.0, 0.0), rz=0.0, rgb=(0.0, 0.0, 0.0)):
+  sd = SensorData(*g, 0.0, 0.0, 0.0, 0.0, 0.0, rz)
+  return protocol.SensorRecord(t, index, sd, rgb)
+
+
+def expected(r, mask=protocol.ALL_FIELDS):
+  names = [name for i, name in enumerate(protocol.FIELDS) if mask & (1 << i)]
+  q = lambda x: round(x * 1000) / 1000  # noqa: E731
+  return (
+      r.t & protocol.T_MASK if 't' in names else None, r.index,
+      *(q(x) if name in names else 0 for name, x in zip(('gx', 'gy', 'gz'), r.sd[:3])),
+      q(r.sd.rz) if 'rz' in names else 0,
+      *(round(c * 255) / 255 if 'rgb' in names else 0 for c in r.rgb),
+  )
+
+
+def assert_decoded(decoded, records, frame_t, mask=protocol.ALL_FIELDS):
+  assert len(decoded) == len(records)
+  for got, r in zip(decoded, records):
+    want = expected(r, mask)
+    if want[0] is None:
+      want = (frame_t, *want[1:])
+    assert got == pytest.approx(want)
+
+
+def test_keyframe_and_delta_frames():
+  encoder = protocol.FrameEncoder(keyframe_interval=3)
+  decoder = protocol.FrameDecoder()
+  for k in range(7):
+    records = [
+        record(50 * k, 0, g=(9.81, -0.5 * k, 0.1), rz=0.01 * k, rgb=(1.0, 0.5, 0.0)),
+        record(50 * k + 3, 1, g=(-9.81, 3.0, -k), rz=-2.0, rgb=(0.0, k / 7, 1.0)),
+    ]
+    frame = encoder.encode(50 * k, records)
+    assert frame[0] == (protocol.FLAG_KEYFRAME if k % 3 == 0 else 0)
+    assert_decoded(decoder.decode(frame), records, 50 * k)
+
+
+def test_delta_frames_are_small():
+  encoder = protocol.FrameEncoder()
+  r = record(1000, 0, g=(9.81, 0.0, 0.0), rgb=(1.0, 0.0, 0.0))
+  keyframe = encoder.encode(1000, [r])
+  delta = encoder.encode(1000, [r])
+  assert len(delta) < len(keyframe)
+  assert len(delta) == 7 + 1 + 8  # header, index, one byte per component
+
+
+def test_quantization_clamps():
+  decoder = protocol.FrameDecoder()
+  r = record(0, 0, g=(100.0, -100.0, 0.0), rgb=(2.0, -1.0, 0.5))
+  (_, _, gx, gy, *_, red, green, _) = decoder.decode(protocol.FrameEncoder().encode(0, [r]))[0]
+  assert (gx, gy) == (32.767, -32.768)
+  assert (red, green) == (1.0, 0.0)
+
+
+def test_t_wraparound():
+  encoder = protocol.FrameEncoder()
+  decoder = protocol.FrameDecoder()
+  for t in (2**32 - 100, 2**32 - 1, 2**32, 2**32 + 50):
+    records = [record(t, 0)]
+    assert_decoded(decoder.decode(encoder.encode(t, records)), records, t & protocol.T_MASK)
+  assert len(protocol.pack_v1(record(2**32 + 5, 0))) == 33
+
+
+def test_set_fields_mid_stream():
+  encoder = protocol.FrameEncoder()
+  decoder = protocol.FrameDecoder()
+  records = [record(10, 0, g=(1.0, 2.0, 3.0), rz=0.5, rgb=(0.2, 0.4, 0.6))]
+  assert_decoded(decoder.decode(encoder.encode(10, records)), records, 10)
+  assert_decoded(decoder.decode(encoder.encode(20, records)), records, 20)
+
+  mask = protocol.parse_fields('gx,rgb')
+  encoder.set_fields(mask)
+  frame = encoder.encode(30, records)
+  assert frame[0] == protocol.FLAG_KEYFRAME
+  assert frame[5] == mask
+  assert_decoded(decoder.decode(frame), records, 30, mask)
+  records = [record(40, 0, g=(1.5, 2.0, 3.0), rgb=(0.3, 0.4, 0.6))]
+  assert_decoded(decoder.decode(encoder.encode(40, records)), records, 40, mask)
+
+
+def test_client_appearing_in_delta_frame():
+  encoder = protocol.FrameEncoder()
+  decoder = protocol.FrameDecoder()
+  first = [record(10, 0, g=(9.81, 0.0, 0.0))]
+  assert_decoded(decoder.decode(encoder.encode(10, first)), first, 10)
+  both = [record(20, 0, g=(9.8, 0.1, 0.0)), record(15, 1, g=(0.0, 9.81, 0.0), rgb=(0.0, 1.0, 0.0))]
+  frame = encoder.encode(20, both)
+  assert frame[0] == 0
+  assert_decoded(decoder.decode(frame), both, 20)
+  assert_decoded(decoder.decode(encoder.encode(30, both)), both, 30)
+
+
+def test_parse_fields():
+  assert protocol.parse_fields('') == protocol.ALL_FIELDS
+  assert protocol.parse_fields('t, rgb') == 0b100001
+  with pytest.raises(ValueError):
+    protocol.parse_fields('gx,foo')
+
+
+@pytest.mark.skipif(not shutil.which('node'), reason='node not installed')
+def test_js_decoder_matches(tmp_path):
+  encoder = protocol.FrameEncoder(keyframe_interval=4)
+  frames = []
+  for k in range(10):
+    if k == 6:
+      encoder.set_fields(protocol.parse_fields('t,gz,rgb'))
+    records = [record(2**32 - 200 + 50 * k, i, g=(i - k, 9.81, -k / 3), rz=k / 10, rgb=(k / 10, 0.5, i / 3))
+               for i in range(min(3, 1 + k // 2))]
+    frames.append(encoder.encode(2**32 - 200 + 50 * k, records))
+
+  decoder = protocol.FrameDecoder()
+  want = [decoder.decode(frame) for frame in frames]
+
+  shutil.copy(pathlib.Path(__file__).parent / 'static' / 'types.js', tmp_path / 'types.mjs')
+  (tmp_path / 'frames.json').write_text(json.dumps([list(frame) for frame in frames]))
+  (tmp_path / 'decode.mjs').write_text('''
+import { FrameDecoder } from './types.mjs';
+import fs from 'fs';
+const decoder = new FrameDecoder();
+const frames = JSON.parse(fs.readFileSync(process.argv[2]));
+console.log(JSON.stringify(frames.map(f => decoder.decode(new Uint8Array(f).buffer))));
+''')
+  out = subprocess.run(
+      ['node', tmp_path / 'decode.mjs', tmp_path / 'frames.json'],
+      capture_output=True, check=True, text=True,
+  ).stdout
+  got = json.loads(out)
+  assert len(got) == len(want)
+  for got_frame, want_frame in zip(got, want):
+    assert [tuple(r) for r in got_frame] == [pytest.approx(r) for r in want_frame]